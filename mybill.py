@@ -1,7 +1,23 @@
+import hashlib
+
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from pandas.api.types import is_datetime64_any_dtype
 import streamlit as st
 
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # =====================
 # 页面设置
 # =====================
@@ -30,40 +46,179 @@ if uploaded_file is None:
 # =====================
 # 数据读取与预处理
 # =====================
-@st.cache_data
-def load_data(file):
+# 仪表盘实际用到的列，其余列（备注、支付方式、商户等）读取时直接跳过
+USED_COLUMNS = ["日期", "金额", "收支类型", "类别", "二级分类", "标签"]
+
+def read_bill(file):
+    # 优先用 polars + calamine 解析（Arrow 列式解码），再转回 pandas
+    if pl is not None:
+        try:
+            return pl.read_excel(
+                file.getvalue(), engine="calamine", columns=USED_COLUMNS
+            ).to_pandas()
+        except ImportError:
+            pass
+
+    # 其次使用 pandas 的 calamine 引擎（比 openpyxl / xlrd 快数倍），未安装时回退
+    try:
+        return pd.read_excel(file, engine="calamine", usecols=USED_COLUMNS)
+    except ImportError:
+        file.seek(0)
+
     filename = file.name.lower()
 
     if filename.endswith(".xls"):
-        df = pd.read_excel(file, engine="xlrd")
-    else:
-        df = pd.read_excel(file, engine="openpyxl")
-
-    df["日期"] = pd.to_datetime(df["日期"])
-    df["年份"] = df["日期"].dt.year
-    df["月份"] = df["日期"].dt.to_period("M").astype(str)
-    df["金额_abs"] = df["金额"].abs()
+        return pd.read_excel(file, engine="xlrd", usecols=USED_COLUMNS)
+    return pd.read_excel(file, engine="openpyxl", usecols=USED_COLUMNS)
+
+if njit is not None:
+    # 安装了 numba 时用编译后的单次循环累加；并行累加存在写竞争，保持串行
+    @njit(cache=True)
+    def cat_month_sum(cat_codes, month_codes, vals, n_cat, n_month):
+        out = np.zeros((n_cat, n_month))
+        for i in range(vals.shape[0]):
+            out[cat_codes[i], month_codes[i]] += vals[i]
+        return out
+else:
+    def cat_month_sum(cat_codes, month_codes, vals, n_cat, n_month):
+        # 把（类别, 月份）编码展平为单个下标，一次 bincount 完成二维累加
+        flat = cat_codes.astype(np.int64) * n_month + month_codes
+        return np.bincount(
+            flat, weights=vals, minlength=n_cat * n_month
+        ).reshape(n_cat, n_month)
+
+def sum_by_cat_month(df):
+    """按类别、月份汇总金额，结果与 observed=True 的 groupby 一致"""
+    cat_codes = df["类别"].cat.codes.to_numpy()
+    month_codes = df["月份"].cat.codes.to_numpy()
+    vals = np.nan_to_num(df["金额"].to_numpy())
+
+    # 类别缺失时编码为 -1，groupby 会丢弃这些行
+    valid = cat_codes >= 0
+    cat_codes, month_codes, vals = (
+        cat_codes[valid], month_codes[valid], vals[valid]
+    )
 
-    return df
+    cats = df["类别"].cat.categories
+    months = df["月份"].cat.categories
+    sums = cat_month_sum(
+        cat_codes, month_codes, vals, len(cats), len(months)
+    )
+    counts = cat_month_sum(
+        cat_codes, month_codes, np.ones_like(vals), len(cats), len(months)
+    )
 
-df = load_data(uploaded_file)
+    cat_idx, month_idx = np.nonzero(counts)
+    return pd.Series(
+        sums[cat_idx, month_idx].astype("float32"),
+        index=pd.MultiIndex(
+            levels=[cats, months],
+            codes=[cat_idx, month_idx],
+            names=["类别", "月份"]
+        ),
+        name="金额"
+    )
 
-income_df = df[df["收支类型"] == "收入"]
-expense_df = df[df["收支类型"] == "支出"]
+# 按文件内容哈希在进程内共享解析结果：同一账单在所有会话中只解析一次，
+# 命中时直接返回同一对象，不再逐次反序列化；调用方只读不改
+@st.cache_resource(max_entries=8)
+def load_data(digest, _file):
+    df = read_bill(_file)
+
+    # calamine 通常已解析为 datetime64；否则先走固定格式的快速路径
+    if not is_datetime64_any_dtype(df["日期"]):
+        try:
+            df["日期"] = pd.to_datetime(
+                df["日期"], format="%Y-%m-%d", cache=True
+            )
+        except ValueError:
+            df["日期"] = pd.to_datetime(df["日期"], cache=True)
+    df = df.dropna(subset=["日期"])
+
+    # 以“自 1970-01 起的月数”做整数运算，月份字符串只按月份区间生成一次
+    months = df["日期"].to_numpy().astype("datetime64[M]").astype("int64")
+    df["年份"] = (months // 12 + 1970).astype("int16")
+
+    first = months.min()
+    labels = np.datetime_as_string(
+        np.arange(first, months.max() + 1).astype("datetime64[M]"),
+        unit="M"
+    )
+    df["月份"] = pd.Categorical.from_codes(
+        months - first,
+        categories=labels,
+        ordered=True
+    )
 
-all_years = sorted(df["年份"].unique())
+    # 年份 / 月份已派生完毕，去掉 8 字节的 datetime64 列以压缩每行宽度
+    del df["日期"]
+
+    # 收支方向已由“收支类型”表示，金额原地取绝对值并降为 float32
+    amount = df["金额"].to_numpy(dtype="float32", copy=True)
+    np.abs(amount, out=amount)
+    df["金额"] = amount
+
+    # 分类列转为 category，groupby 时按整数编码分组
+    for col in ["类别", "二级分类", "标签", "收支类型"]:
+        df[col] = df[col].astype("category")
+
+    expense_df = df[df["收支类型"] == "支出"]
+
+    # 预先汇总各图表所需的数据，交互时只需按键取切片
+    pivots = {
+        "cat_year": df.groupby(
+            ["收支类型", "年份", "类别"], observed=True
+        )["金额"].sum(),
+        "subcat": expense_df.groupby(
+            ["类别", "二级分类"], observed=True
+        )["金额"].sum(),
+        "tag_year": expense_df.groupby(
+            ["年份", "标签"], observed=True
+        )["金额"].sum(),
+        "trend": sum_by_cat_month(expense_df),
+    }
+
+    # 下拉框选项：每个类别下出现过的二级分类，按出现顺序
+    levels = {
+        parent: sub.dropna().unique().tolist()
+        for parent, sub in expense_df.groupby(
+            "类别", observed=True, sort=False
+        )["二级分类"]
+    }
+
+    return pivots, levels
+
+file_digest = hashlib.blake2b(
+    uploaded_file.getvalue(), digest_size=16
+).hexdigest()
+pivots, levels = load_data(file_digest, uploaded_file)
+
+all_years = sorted(pivots["cat_year"].index.unique(level="年份"))
 latest_year = all_years[-1]
 
+def lookup(pivot, key):
+    """按前缀键取汇总表切片，不存在时返回空 Series"""
+    try:
+        return pivot.loc[key]
+    except KeyError:
+        # 保留剩余层的名称，供饼图悬停文字使用
+        depth = len(key) if isinstance(key, tuple) else 1
+        return pd.Series(
+            dtype=pivot.dtype,
+            name=pivot.name,
+            index=pd.Index([], name=pivot.index.names[depth])
+        )
+
 # =====================
 # 通用饼图函数
 # =====================
-def create_pie_chart(data, names_col, mode, title):
-    d = data.groupby(names_col)["金额_abs"].sum().reset_index()
-
+# 图表按（数据切片, 选项）缓存为 dict，相同选择不再重复构建 Plotly 图对象
+@st.cache_data(show_spinner=False)
+def create_pie_chart(s, mode, title):
     fig = px.pie(
-        d,
-        values="金额_abs",
-        names=names_col,
+        values=s.values,
+        names=s.index,
+        labels={"names": s.index.name, "values": s.name},
         hole=0.4
     )
 
@@ -80,7 +235,45 @@ def create_pie_chart(data, names_col, mode, title):
         title_x=0.5,
         margin=dict(t=50, b=0, l=0, r=0)
     )
-    return fig
+    return fig.to_dict()
+
+# =====================
+# 月度趋势图函数
+# =====================
+@st.cache_data(show_spinner=False)
+def create_trend_chart(trend, trend_cats):
+    rows = (len(trend_cats) + 1) // 2
+
+    # 所有类别放进同一张 2 列子图，只需序列化、渲染一次
+    fig = make_subplots(
+        rows=rows,
+        cols=2,
+        subplot_titles=trend_cats,
+        horizontal_spacing=0.05
+    )
+
+    for i, cat in enumerate(trend_cats):
+        s = trend.loc[cat]
+        fig.add_trace(
+            go.Scatter(
+                x=s.index,
+                y=s.values,
+                name=cat,
+                mode="lines+markers+text",
+                text=s.values,
+                texttemplate="%{text:.0f}",
+                textposition="top center",
+                line=dict(width=3),
+                hovertemplate="月份=%{x}<br>金额=%{y:.0f}<extra></extra>"
+            ),
+            row=i // 2 + 1,
+            col=i % 2 + 1
+        )
+
+    fig.update_xaxes(title_text="月份")
+    fig.update_yaxes(title_text="金额")
+    fig.update_layout(height=350 * rows, showlegend=False)
+    return fig.to_dict()
 
 # =====================
 # 第一部分：收入 / 支出构成（按年）
@@ -105,8 +298,7 @@ with c1:
     )
 
     fig_income = create_pie_chart(
-        income_df[income_df["年份"] == income_year],
-        "类别",
+        lookup(pivots["cat_year"], ("收入", income_year)),
         income_mode,
         f"{income_year} 年收入构成"
     )
@@ -128,8 +320,7 @@ with c2:
     )
 
     fig_expense = create_pie_chart(
-        expense_df[expense_df["年份"] == expense_year],
-        "类别",
+        lookup(pivots["cat_year"], ("支出", expense_year)),
         expense_mode,
         f"{expense_year} 年支出构成"
     )
@@ -148,11 +339,12 @@ with c3:
     st.subheader("🔍 支出明细（二级分类）")
     main_cat = st.selectbox(
         "选择类别",
-        expense_df["类别"].unique(),
+        list(levels),
         key="detail_main_cat"
     )
 
-    sub_opts = expense_df[expense_df["类别"] == main_cat]["二级分类"].unique()
+    # 账单无支出时类别下拉框为空，main_cat 为 None
+    sub_opts = levels.get(main_cat, [])
     sub_sel = st.multiselect(
         "选择二级分类",
         sub_opts,
@@ -168,14 +360,10 @@ with c3:
     )
 
     if sub_sel:
-        d_detail = expense_df[
-            (expense_df["类别"] == main_cat) &
-            (expense_df["二级分类"].isin(sub_sel))
-        ]
+        d_detail = lookup(pivots["subcat"], main_cat)
 
         fig_detail = create_pie_chart(
-            d_detail,
-            "二级分类",
+            d_detail[d_detail.index.isin(sub_sel)],
             detail_mode,
             f"[{main_cat}] 支出明细"
         )
@@ -198,8 +386,7 @@ with c4:
     )
 
     fig_tag = create_pie_chart(
-        expense_df[expense_df["年份"] == tag_year],
-        "标签",
+        lookup(pivots["tag_year"], tag_year),
         tag_mode,
         f"{tag_year} 年支出标签占比"
     )
@@ -217,43 +404,18 @@ order = [
      "旅游", "餐饮", "固定支出", "交通", "其他"
 ]
 
-for i in range(0, len(order), 2):
-    c1, c2 = st.columns(2)
+trend = pivots["trend"]
+present = set(trend.index.get_level_values("类别"))
+trend_cats = [cat for cat in order if cat in present]
 
-    for col, cat in zip([c1, c2], order[i:i+2]):
-        with col:
-            d_trend = (
-                expense_df[expense_df["类别"] == cat]
-                .groupby("月份")["金额_abs"]
-                .sum()
-                .reset_index()
-            )
+missing = [cat for cat in order if cat not in present]
+if missing:
+    st.info(f"{'、'.join(missing)} 暂无数据")
 
-            if d_trend.empty:
-                st.info(f"{cat} 暂无数据")
-                continue
-
-            fig = px.line(
-                d_trend,
-                x="月份",
-                y="金额_abs",
-                title=cat,
-                markers=True,
-                text="金额_abs"
-            )
-
-            fig.update_traces(
-                texttemplate="%{text:.0f}",
-                textposition="top center",
-                line=dict(width=3)
-            )
-
-            fig.update_layout(
-                xaxis_title="月份",
-                yaxis_title="金额"
-            )
-
-            st.plotly_chart(fig, use_container_width=True)
+if trend_cats:
+    st.plotly_chart(
+        create_trend_chart(trend, trend_cats), use_container_width=True
+    )
 
 st.caption("🚀 Streamlit Cloud · 安全方案 A · 不落盘 · 不入库")
 